@@ -1,5 +1,52 @@
 import numpy as np
-from scipy.stats import median_abs_deviation
+from numba import jit
+
+# 1 / Phi^-1(3/4): scales the MAD to the std of a normal distribution
+MAD_NORMAL_SCALE = 1.482602218505602
+
+@jit(nopython=True, nogil=True, cache=True)
+def mad_normal(x: np.ndarray) -> float:
+    """
+    Median absolute deviation, scaled to match the standard deviation
+    for normally distributed data (same as scipy's scale='normal').
+    
+    np.median in Numba uses quickselect, so this is O(N) with a single
+    temporary buffer instead of SciPy's full sort.
+    
+    Args:
+        x: 1D array, must not contain NaNs.
+        
+    Returns:
+        float: Normal-scaled MAD.
+    """
+    med = np.median(x)
+    return MAD_NORMAL_SCALE * np.median(np.abs(x - med))
+
+@jit(nopython=True, nogil=True, cache=True)
+def nan_median(x: np.ndarray):
+    """
+    Median of the non-NaN values and the NaN count, in a single pass.
+    
+    Filling the NaNs with this median leaves the median unchanged, so the
+    result can be reused for normalization after imputation.
+    
+    Args:
+        x: 1D array, may contain NaNs.
+        
+    Returns:
+        tuple: (median, n_nan), median is NaN if every value is NaN.
+    """
+    n = len(x)
+    valid = np.empty(n, dtype=np.float64)
+    n_valid = 0
+    for i in range(n):
+        v = x[i]
+        if not np.isnan(v):
+            valid[n_valid] = v
+            n_valid += 1
+    if n_valid == 0:
+        return np.nan, n
+    return np.median(valid[:n_valid]), n - n_valid
 
 def calculate_adaptive_sensitivity(flux_array: np.ndarray, base_sensitivity: float = 0.03) -> float:
     """
@@ -16,7 +63,7 @@ def calculate_adaptive_sensitivity(flux_array: np.ndarray, base_sensitivity: flo
         float: Adjusted sensitivity value.
     """
     # calculate robust noise estimate
-    mad = median_abs_deviation(flux_array, scale='normal')
+    mad = mad_normal(flux_array)
     
     # typical TESS noise is ~200 ppm, normalized MAD ~1.0
     # if MAD is higher, reduce sensitivity proportionally
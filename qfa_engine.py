@@ -1,80 +1,293 @@
 import numpy as np
 from typing import Tuple
-from numba import jit
+from numba import jit, prange
 import logging
 
+try:
+    # optional AVX2 kernel, see qfa_kernel.c / setup.py
+    from qfa_kernel import qfa_scan as _avx2_scan
+except ImportError:
+    _avx2_scan = None
+
 logging.getLogger('numba').setLevel(logging.WARNING)
 
-@jit(nopython=True, fastmath=True)
-def _multi_scale_scan_optimized(data_stream, sensitivity, decays, gain_autoscaling=True):
+# max decays the AVX2 kernel holds in its lanes
+_AVX2_MAX_DECAYS = 8
+
+def _gate_basis(data_stream: np.ndarray, sensitivity: float, gain_autoscaling: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized Ry gate basis (cos, sin) for the whole stream.
+
+    Done in NumPy ahead of the kernel so the trig runs through NumPy's SIMD
+    loops instead of one scalar call per sample inside the JIT loop.
+    The trig is evaluated in float32 (twice the SIMD width, ~1e-7 error on
+    O(1) normalized flux), the kernels keep accumulating in float64.
+    """
+    x = np.asarray(data_stream, dtype=np.float32)
+    sensitivity = np.float32(sensitivity)
+    # max angle
+    max_angle = np.float32(np.pi / 2.0)
+    # calculate the angle
+    if gain_autoscaling:
+        theta = max_angle * np.tanh((x * sensitivity) / max_angle)
+    else:
+        theta = x * sensitivity
+    # calculate the cos and sin
+    # basis of the gate, and the coherence we want to measure
+    return np.cos(theta).astype(np.float64), np.sin(theta).astype(np.float64)
+
+@jit(nopython=True, fastmath=True, inline='always')
+def _decay_step(r00, r01, r10, r11, c2, s2, cs, d):
+    """
+    Ry gate + amplitude damping update for a single decay's state
+    """
+    one_minus_d = 1.0 - d
+    # calculate the terms
+    term_off = r01 + r10
+    term_diag = r00 - r11
+    # calculate the new values
+    n00 = c2 * r00 - cs * term_off + s2 * r11
+    n11 = s2 * r00 + cs * term_off + c2 * r11
+    n01 = c2 * r01 + cs * term_diag - s2 * r10
+    n10 = c2 * r10 + cs * term_diag - s2 * r01
+    return one_minus_d * n00 + d, one_minus_d * n01, one_minus_d * n10, one_minus_d * n11
+
+@jit(nopython=True, fastmath=True, inline='always')
+def _initial_state(n_decays):
+    """
+    |0><0| for every decay, one (r00, r01, r10, r11) row per decay
+    """
+    # the state starts real-diagonal and the gate is a real rotation,
+    # so the imaginary parts stay zero and only the real parts are kept
+    state = np.zeros((n_decays, 4), dtype=np.float64)
+    state[:, 0] = 1.0
+    return state
+
+@jit(nopython=True, fastmath=True, inline='always')
+def _bank_step(state, c2, s2, cs, decays, with_coherence):
+    """
+    Updates every decay's state in place, returns (fidelity, coherence)
+    coherence is left at 0 when with_coherence is off
+    """
+    n_decays = len(decays)
+    # initialize the values we want to track
+    min_fidelity = 1.0
+    sum_fid = 0.0
+    max_coh = 0.0
+    # loop through the decays
+    # kept serial: the decays are independent, but a prange region
+    # per sample costs far more than the 5-wide fan-out it splits
+    for k in range(n_decays):
+        # update the values
+        r00, r01, r10, r11 = _decay_step(
+            state[k, 0], state[k, 1], state[k, 2], state[k, 3], c2, s2, cs, decays[k]
+        )
+        state[k, 0], state[k, 1], state[k, 2], state[k, 3] = r00, r01, r10, r11
+        # calculate the fidelity and coherence
+        # fidelity is r00
+        # coherence is the magnitude of r01
+        current_fid = r00
+        # update the values we want to track
+        min_fidelity = min(min_fidelity, current_fid)
+        sum_fid += current_fid
+        if with_coherence:
+            max_coh = max(max_coh, abs(r01))
+    # calculate the final values
+    return 0.5 * (sum_fid/n_decays) + 0.5 * min_fidelity, max_coh
+
+@jit(nopython=True, nogil=True, fastmath=True, boundscheck=False, cache=True)
+def _multi_scale_scan_optimized(cos_theta, sin_theta, decays, with_coherence=True):
     """
     Static QFA Kernel
+    Returns (fidelity, coherence), coherence is empty when with_coherence is off.
     """
     # forward scan, preparing the empty arrays
-    n_points = len(data_stream)
+    n_points = len(cos_theta)
     n_decays = len(decays)
     fidelity_trace = np.zeros(n_points, dtype=np.float64)
-    coherence_trace = np.zeros(n_points, dtype=np.float64)
+    coherence_trace = np.zeros(n_points if with_coherence else 0, dtype=np.float64)
     # initialize the variables
-    r00 = np.ones(n_decays, dtype=np.complex128)
-    r01 = np.zeros(n_decays, dtype=np.complex128)
-    r10 = np.zeros(n_decays, dtype=np.complex128)
-    r11 = np.zeros(n_decays, dtype=np.complex128)
-    # max angle
-    max_angle = np.pi / 2.0
+    state = _initial_state(n_decays)
     # loop through the data stream
     for t in range(n_points):
-        # get the value
-        val = data_stream[t]
-        # calculate the angle
-        if gain_autoscaling:
-            theta = max_angle * np.tanh((val * sensitivity) / max_angle)
-        else:
-            theta = val * sensitivity
-        # calculate the cos and sin
-        # basis of the gate, and the coherence we want to measure    
-        c = np.cos(theta)
-        s = np.sin(theta)
+        c, s = cos_theta[t], sin_theta[t]
         c2, s2, cs = c*c, s*s, c*s
-        # initialize the values we want to track
-        min_fidelity = 1.0
-        sum_fid = 0.0
-        max_coh = 0.0
-        # loop through the decays
-        for k in range(n_decays):
-            # get the decay
-            d = decays[k]
-            one_minus_d = 1.0 - d
-            # get the previous values
-            old_r00, old_r01, old_r10, old_r11 = r00[k], r01[k], r10[k], r11[k]
-            # calculate the terms
-            term_off = old_r01 + old_r10
-            term_diag = old_r00 - old_r11
-            # calculate the new values
-            n00 = c2 * old_r00 - cs * term_off + s2 * old_r11
-            n11 = s2 * old_r00 + cs * term_off + c2 * old_r11
-            n01 = c2 * old_r01 + cs * term_diag - s2 * old_r10
-            n10 = c2 * old_r10 + cs * term_diag - s2 * old_r01
-            # update the values
-            r00[k] = one_minus_d * n00 + d
-            r01[k] = one_minus_d * n01
-            r10[k] = one_minus_d * n10
-            r11[k] = one_minus_d * n11
-            # calculate the fidelity and coherence
-            # fidelity is the real part of r00
-            # coherence is the magnitude of r01
-            current_fid = r00[k].real
-            coh = np.sqrt(r01[k].real**2 + r01[k].imag**2)
-            # update the values we want to track
-            min_fidelity = min(min_fidelity, current_fid)
-            sum_fid += current_fid
-            max_coh = max(max_coh, coh)
-        # calculate the final values    
-        fidelity_trace[t] = 0.5 * (sum_fid/n_decays) + 0.5 * min_fidelity
-        coherence_trace[t] = max_coh
+        fidelity_trace[t], coh = _bank_step(state, c2, s2, cs, decays, with_coherence)
+        if with_coherence:
+            coherence_trace[t] = coh
         
     return fidelity_trace, coherence_trace
 
+@jit(nopython=True, nogil=True, fastmath=True, boundscheck=False, cache=True)
+def _bidir_scan(cos_theta, sin_theta, decays, with_coherence=True):
+    """
+    Fused Bidirectional QFA Kernel
+
+    Runs the forward and reverse scans in the same pass over the stream,
+    the reverse state reads index n-1-t so no reversed copy is made.
+    Each index is written by whichever direction reaches it first and
+    MAX-combined by the other, so no separate backward trace is kept.
+    Returns (combined fidelity, forward coherence), coherence is empty
+    when with_coherence is off.
+    """
+    n_points = len(cos_theta)
+    n_decays = len(decays)
+    fidelity_trace = np.zeros(n_points, dtype=np.float64)
+    coherence_trace = np.zeros(n_points if with_coherence else 0, dtype=np.float64)
+    # one state set per direction
+    fwd_state = _initial_state(n_decays)
+    bwd_state = _initial_state(n_decays)
+    for t in range(n_points):
+        tb = n_points - 1 - t
+        # forward direction
+        c, s = cos_theta[t], sin_theta[t]
+        c2, s2, cs = c*c, s*s, c*s
+        fwd_fid, coh = _bank_step(fwd_state, c2, s2, cs, decays, with_coherence)
+        if with_coherence:
+            coherence_trace[t] = coh
+        # conservative combination (MAX) without shift
+        fidelity_trace[t] = fwd_fid if t <= tb else max(fidelity_trace[t], fwd_fid)
+        # backward direction
+        c, s = cos_theta[tb], sin_theta[tb]
+        c2, s2, cs = c*c, s*s, c*s
+        bwd_fid, _ = _bank_step(bwd_state, c2, s2, cs, decays, False)
+        fidelity_trace[tb] = bwd_fid if t < tb else max(fidelity_trace[tb], bwd_fid)
+
+    return fidelity_trace, coherence_trace
+
+
+@jit(nopython=True, fastmath=True, inline='always')
+def _fidelity5(r0, r1, r2, r3, r4):
+    """
+    Mean/min fidelity blend over the 5 decays
+    """
+    min_fidelity = min(1.0, r0, r1, r2, r3, r4)
+    return 0.5 * ((r0 + r1 + r2 + r3 + r4)/5.0) + 0.5 * min_fidelity
+
+def _make_scan5(bidirectional, with_coherence):
+    """
+    Builds a QFA kernel specialized for exactly 5 decays.
+
+    bidirectional and with_coherence are frozen into the closure, so their
+    branches are folded away at compile time, and the decay loop is written
+    out so the state values stay in registers instead of arrays.
+    Returns (fidelity, forward coherence), the fidelity is MAX-combined
+    in place as in _bidir_scan when bidirectional is on, the coherence is
+    empty when with_coherence is off.
+    """
+    @jit(nopython=True, nogil=True, fastmath=True, boundscheck=False, cache=True)
+    def _scan5(cos_theta, sin_theta, d0, d1, d2, d3, d4):
+        n_points = len(cos_theta)
+        fidelity_trace = np.zeros(n_points, dtype=np.float64)
+        coherence_trace = np.zeros(n_points if with_coherence else 0, dtype=np.float64)
+        # one (r00, r01, r10, r11) state per decay and direction
+        a00, a01, a10, a11 = 1.0, 0.0, 0.0, 0.0
+        b00, b01, b10, b11 = 1.0, 0.0, 0.0, 0.0
+        e00, e01, e10, e11 = 1.0, 0.0, 0.0, 0.0
+        g00, g01, g10, g11 = 1.0, 0.0, 0.0, 0.0
+        h00, h01, h10, h11 = 1.0, 0.0, 0.0, 0.0
+        ra00, ra01, ra10, ra11 = 1.0, 0.0, 0.0, 0.0
+        rb00, rb01, rb10, rb11 = 1.0, 0.0, 0.0, 0.0
+        re00, re01, re10, re11 = 1.0, 0.0, 0.0, 0.0
+        rg00, rg01, rg10, rg11 = 1.0, 0.0, 0.0, 0.0
+        rh00, rh01, rh10, rh11 = 1.0, 0.0, 0.0, 0.0
+        for t in range(n_points):
+            tb = n_points - 1 - t
+            # forward direction
+            c, s = cos_theta[t], sin_theta[t]
+            c2, s2, cs = c*c, s*s, c*s
+            a00, a01, a10, a11 = _decay_step(a00, a01, a10, a11, c2, s2, cs, d0)
+            b00, b01, b10, b11 = _decay_step(b00, b01, b10, b11, c2, s2, cs, d1)
+            e00, e01, e10, e11 = _decay_step(e00, e01, e10, e11, c2, s2, cs, d2)
+            g00, g01, g10, g11 = _decay_step(g00, g01, g10, g11, c2, s2, cs, d3)
+            h00, h01, h10, h11 = _decay_step(h00, h01, h10, h11, c2, s2, cs, d4)
+            fwd_fid = _fidelity5(a00, b00, e00, g00, h00)
+            if bidirectional and t > tb:
+                fwd_fid = max(fidelity_trace[t], fwd_fid)
+            fidelity_trace[t] = fwd_fid
+            if with_coherence:
+                coherence_trace[t] = max(0.0, abs(a01), abs(b01), abs(e01), abs(g01), abs(h01))
+            if bidirectional:
+                # backward direction
+                c, s = cos_theta[tb], sin_theta[tb]
+                c2, s2, cs = c*c, s*s, c*s
+                ra00, ra01, ra10, ra11 = _decay_step(ra00, ra01, ra10, ra11, c2, s2, cs, d0)
+                rb00, rb01, rb10, rb11 = _decay_step(rb00, rb01, rb10, rb11, c2, s2, cs, d1)
+                re00, re01, re10, re11 = _decay_step(re00, re01, re10, re11, c2, s2, cs, d2)
+                rg00, rg01, rg10, rg11 = _decay_step(rg00, rg01, rg10, rg11, c2, s2, cs, d3)
+                rh00, rh01, rh10, rh11 = _decay_step(rh00, rh01, rh10, rh11, c2, s2, cs, d4)
+                bwd_fid = _fidelity5(ra00, rb00, re00, rg00, rh00)
+                if t >= tb:
+                    bwd_fid = max(fidelity_trace[tb], bwd_fid)
+                fidelity_trace[tb] = bwd_fid
+
+        return fidelity_trace, coherence_trace
+
+    return _scan5
+
+
+_scan5 = _make_scan5(False, False)
+_scan5_coh = _make_scan5(False, True)
+_bidir5 = _make_scan5(True, False)
+_bidir5_coh = _make_scan5(True, True)
+
+
+@jit(nopython=True, nogil=True, parallel=True, fastmath=True, boundscheck=False, cache=True)
+def _scan_batch(cos_theta, sin_theta, lengths, decays, bidirectional):
+    """
+    Batched QFA Kernel
+
+    Each row of the padded (B, N_max) gate basis is an independent stream,
+    only its first lengths[b] samples are scanned. prange spreads the rows
+    over Numba's thread pool. Returns the padded (B, N_max) fidelity.
+    """
+    n_batch, n_max = cos_theta.shape
+    fidelity = np.zeros((n_batch, n_max), dtype=np.float64)
+    for b in prange(n_batch):
+        n = lengths[b]
+        c = cos_theta[b, :n]
+        s = sin_theta[b, :n]
+        if len(decays) == 5:
+            if bidirectional:
+                fid, _ = _bidir5(c, s, decays[0], decays[1], decays[2], decays[3], decays[4])
+            else:
+                fid, _ = _scan5(c, s, decays[0], decays[1], decays[2], decays[3], decays[4])
+        elif bidirectional:
+            fid, _ = _bidir_scan(c, s, decays, False)
+        else:
+            fid, _ = _multi_scale_scan_optimized(c, s, decays, False)
+        fidelity[b, :n] = fid
+    return fidelity
+
+
+def scan_batch(gate_bases: list, decays, bidirectional: bool = True) -> list:
+    """
+    Fidelity scan of several streams in one parallel kernel call.
+
+    Same result as MultiScaleQFA.scan per stream, but the gate bases are
+    padded into one (B, N_max) buffer and scanned by _scan_batch, which
+    amortizes the dispatch over the batch. The bases come from
+    MultiScaleQFA.gate_basis, so callers can build them concurrently.
+    Batch streams of similar length to keep the padding small.
+
+    Args:
+        gate_bases: list of (cos_theta, sin_theta) pairs, one per stream.
+        decays: memory horizons, shared by every stream.
+        
+    Returns:
+        list: one fidelity array per stream.
+    """
+    decays = np.asarray(decays, dtype=np.float64)
+    lengths = np.array([len(c) for c, _ in gate_bases], dtype=np.int64)
+    n_max = lengths.max() if len(lengths) else 0
+    cos_theta = np.ones((len(gate_bases), n_max), dtype=np.float64)
+    sin_theta = np.zeros((len(gate_bases), n_max), dtype=np.float64)
+    for b, (c, s) in enumerate(gate_bases):
+        cos_theta[b, :lengths[b]] = c
+        sin_theta[b, :lengths[b]] = s
+    fidelity = _scan_batch(cos_theta, sin_theta, lengths, decays, bidirectional)
+    return [fidelity[b, :lengths[b]] for b in range(len(gate_bases))]
+
 
 class MultiScaleQFA:
     """
@@ -87,37 +300,45 @@ class MultiScaleQFA:
     """
     def __init__(self, sensitivity: float, decays: list, gain_autoscaling: bool = True):
         self.sensitivity = float(sensitivity)
-        self.decays = np.array(decays, dtype=np.float64)
+        # no copy when handed an existing float64 array (see run_qfa.main)
+        self.decays = np.asarray(decays, dtype=np.float64)
         self.gain_autoscaling = gain_autoscaling
-        
+
+    def gate_basis(self, data_stream: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Ry gate basis (cos, sin) of the stream, the input of scan_batch
+        return _gate_basis(data_stream, self.sensitivity, self.gain_autoscaling)
+
+    def _run(self, data_stream: np.ndarray, bidirectional: bool, with_coherence: bool) -> Tuple[np.ndarray, np.ndarray]:
+        cos_theta, sin_theta = self.gate_basis(data_stream)
+        # prefer the AVX2 kernel when it is built
+        if _avx2_scan is not None and 0 < len(self.decays) <= _AVX2_MAX_DECAYS:
+            fidelity_trace = np.empty(len(cos_theta), dtype=np.float64)
+            coherence_trace = np.empty(len(cos_theta) if with_coherence else 0, dtype=np.float64)
+            _avx2_scan(
+                cos_theta, sin_theta, self.decays, fidelity_trace,
+                coherence_trace if with_coherence else None, bidirectional
+            )
+            return fidelity_trace, coherence_trace
+        # dispatch to the unrolled kernels for the standard 5-decay setup
+        if len(self.decays) == 5:
+            if bidirectional:
+                kernel = _bidir5_coh if with_coherence else _bidir5
+            else:
+                kernel = _scan5_coh if with_coherence else _scan5
+            return kernel(cos_theta, sin_theta, *self.decays)
+        if bidirectional:
+            return _bidir_scan(cos_theta, sin_theta, self.decays, with_coherence)
+        return _multi_scale_scan_optimized(cos_theta, sin_theta, self.decays, with_coherence)
+
     def scan(self, data_stream: np.ndarray, bidirectional: bool = True) -> np.ndarray:
-        # forward scan
-        fwd_fid, _ = _multi_scale_scan_optimized(
-            data_stream, self.sensitivity, self.decays, self.gain_autoscaling
-        )
-        if not bidirectional:
-            return fwd_fid 
-        # backward scan
-        bwd_fid_raw, _ = _multi_scale_scan_optimized(
-            data_stream[::-1], self.sensitivity, self.decays, self.gain_autoscaling
-        )
-        bwd_fid = bwd_fid_raw[::-1]
-        # conservative combination (MAX) without shift
+        # forward (and backward) scan in a single pass
+        # bidirectional kernels return the conservative combination (MAX) without shift
         # was a bit of trial by fire here
-        return np.maximum(fwd_fid, bwd_fid)
+        # coherence is discarded, so the kernels skip computing it
+        fidelity, _ = self._run(data_stream, bidirectional, with_coherence=False)
+        return fidelity
     
     def scan_with_coherence(self, data_stream: np.ndarray, bidirectional: bool = True):
-        # forward scan
-        fwd_fid, fwd_coh = _multi_scale_scan_optimized(
-            data_stream, self.sensitivity, self.decays, self.gain_autoscaling
-        )
-        if not bidirectional:
-            return fwd_fid, fwd_coh
-        # backward scan
-        bwd_fid_raw, bwd_coh_raw = _multi_scale_scan_optimized(
-            data_stream[::-1], self.sensitivity, self.decays, self.gain_autoscaling
-        )
-        bwd_fid = bwd_fid_raw[::-1]
-        
-        # return unshifted MAX
-        return np.maximum(fwd_fid, bwd_fid), fwd_coh
+        # forward (and backward) scan in a single pass
+        # returns unshifted MAX fidelity and the forward coherence
+        return self._run(data_stream, bidirectional, with_coherence=True)
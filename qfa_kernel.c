@@ -0,0 +1,202 @@
+/*
+ * AVX2 QFA Kernel
+ *
+ * Same state update as the Numba kernels in qfa_engine.py, with the decay
+ * axis mapped onto SIMD lanes: up to 8 decays are held as two __m256d per
+ * density-matrix component, so one FMA updates 4 decays at once.
+ * Padding lanes repeat decay 0 (min/max unaffected) and get zero weight
+ * in the mean.
+ *
+ * Build: python setup.py build_ext --inplace
+ * On non-x86 hosts the module still builds but refuses to import, so
+ * qfa_engine falls back to the Numba kernels.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+
+#include <immintrin.h>
+#include <math.h>
+
+#define QFA_MAX_DECAYS 8
+
+typedef struct {
+    __m256d r00[2], r01[2], r10[2], r11[2];
+} qfa_bank;
+
+#define QFA_SIMD __attribute__((target("avx2,fma")))
+
+static QFA_SIMD void bank_init(qfa_bank *bank)
+{
+    for (int i = 0; i < 2; i++) {
+        bank->r00[i] = _mm256_set1_pd(1.0);
+        bank->r01[i] = _mm256_setzero_pd();
+        bank->r10[i] = _mm256_setzero_pd();
+        bank->r11[i] = _mm256_setzero_pd();
+    }
+}
+
+/* Ry gate + amplitude damping for every lane, returns fidelity and (if non-NULL) coherence */
+static inline QFA_SIMD __attribute__((always_inline)) void bank_step(
+    qfa_bank *bank, double c, double s,
+    const __m256d d[2], const __m256d one_minus_d[2], const __m256d weight[2],
+    double *fidelity, double *coherence)
+{
+    const __m256d c2 = _mm256_set1_pd(c * c);
+    const __m256d s2 = _mm256_set1_pd(s * s);
+    const __m256d cs = _mm256_set1_pd(c * s);
+    const __m256d abs_mask = _mm256_castsi256_pd(_mm256_set1_epi64x(0x7fffffffffffffffLL));
+
+    for (int i = 0; i < 2; i++) {
+        __m256d r00 = bank->r00[i], r01 = bank->r01[i];
+        __m256d r10 = bank->r10[i], r11 = bank->r11[i];
+        __m256d term_off = _mm256_add_pd(r01, r10);
+        __m256d term_diag = _mm256_sub_pd(r00, r11);
+        __m256d n00 = _mm256_fmadd_pd(s2, r11, _mm256_fnmadd_pd(cs, term_off, _mm256_mul_pd(c2, r00)));
+        __m256d n11 = _mm256_fmadd_pd(c2, r11, _mm256_fmadd_pd(cs, term_off, _mm256_mul_pd(s2, r00)));
+        __m256d n01 = _mm256_fnmadd_pd(s2, r10, _mm256_fmadd_pd(cs, term_diag, _mm256_mul_pd(c2, r01)));
+        __m256d n10 = _mm256_fnmadd_pd(s2, r01, _mm256_fmadd_pd(cs, term_diag, _mm256_mul_pd(c2, r10)));
+        bank->r00[i] = _mm256_fmadd_pd(one_minus_d[i], n00, d[i]);
+        bank->r01[i] = _mm256_mul_pd(one_minus_d[i], n01);
+        bank->r10[i] = _mm256_mul_pd(one_minus_d[i], n10);
+        bank->r11[i] = _mm256_mul_pd(one_minus_d[i], n11);
+    }
+
+    /* horizontal min / weighted sum over the 8 lanes */
+    __m256d mn = _mm256_min_pd(bank->r00[0], bank->r00[1]);
+    __m256d sm = _mm256_fmadd_pd(weight[1], bank->r00[1], _mm256_mul_pd(weight[0], bank->r00[0]));
+    __m128d mn2 = _mm_min_pd(_mm256_castpd256_pd128(mn), _mm256_extractf128_pd(mn, 1));
+    __m128d sm2 = _mm_add_pd(_mm256_castpd256_pd128(sm), _mm256_extractf128_pd(sm, 1));
+    double min_fidelity = fmin(1.0, _mm_cvtsd_f64(_mm_min_sd(mn2, _mm_unpackhi_pd(mn2, mn2))));
+    double mean_fidelity = _mm_cvtsd_f64(_mm_add_sd(sm2, _mm_unpackhi_pd(sm2, sm2)));
+    *fidelity = 0.5 * mean_fidelity + 0.5 * min_fidelity;
+
+    /* horizontal max of |r01| */
+    if (coherence) {
+        __m256d mx = _mm256_max_pd(_mm256_and_pd(bank->r01[0], abs_mask), _mm256_and_pd(bank->r01[1], abs_mask));
+        __m128d mx2 = _mm_max_pd(_mm256_castpd256_pd128(mx), _mm256_extractf128_pd(mx, 1));
+        *coherence = _mm_cvtsd_f64(_mm_max_sd(mx2, _mm_unpackhi_pd(mx2, mx2)));
+    }
+}
+
+/* forward (and fused backward, MAX-combined) scan, see _bidir_scan, coherence_trace may be NULL */
+static QFA_SIMD void qfa_scan_avx2(
+    const double *cos_theta, const double *sin_theta, Py_ssize_t n_points,
+    const double *decays, Py_ssize_t n_decays, int bidirectional,
+    double *fidelity_trace, double *coherence_trace)
+{
+    double lane_d[QFA_MAX_DECAYS], lane_w[QFA_MAX_DECAYS];
+    for (int k = 0; k < QFA_MAX_DECAYS; k++) {
+        lane_d[k] = decays[k < n_decays ? k : 0];
+        lane_w[k] = k < n_decays ? 1.0 / (double)n_decays : 0.0;
+    }
+    __m256d d[2], one_minus_d[2], weight[2];
+    for (int i = 0; i < 2; i++) {
+        d[i] = _mm256_loadu_pd(lane_d + 4 * i);
+        one_minus_d[i] = _mm256_sub_pd(_mm256_set1_pd(1.0), d[i]);
+        weight[i] = _mm256_loadu_pd(lane_w + 4 * i);
+    }
+
+    qfa_bank fwd, bwd;
+    bank_init(&fwd);
+    bank_init(&bwd);
+    double fid;
+    for (Py_ssize_t t = 0; t < n_points; t++) {
+        Py_ssize_t tb = n_points - 1 - t;
+        /* forward direction */
+        bank_step(&fwd, cos_theta[t], sin_theta[t], d, one_minus_d, weight, &fid,
+                  coherence_trace ? coherence_trace + t : NULL);
+        fidelity_trace[t] = (bidirectional && t > tb) ? fmax(fidelity_trace[t], fid) : fid;
+        if (bidirectional) {
+            /* backward direction */
+            bank_step(&bwd, cos_theta[tb], sin_theta[tb], d, one_minus_d, weight, &fid, NULL);
+            fidelity_trace[tb] = t >= tb ? fmax(fidelity_trace[tb], fid) : fid;
+        }
+    }
+}
+
+static PyObject *qfa_scan(PyObject *self, PyObject *args)
+{
+    Py_buffer cos_buf, sin_buf, dec_buf, fid_buf, coh_buf;
+    PyObject *coh_obj;
+    int bidirectional;
+    if (!PyArg_ParseTuple(args, "y*y*y*w*Op:qfa_scan",
+                          &cos_buf, &sin_buf, &dec_buf, &fid_buf, &coh_obj, &bidirectional))
+        return NULL;
+
+    /* coherence output is optional, None skips it */
+    int with_coherence = coh_obj != Py_None;
+    coh_buf.buf = NULL;
+    coh_buf.obj = NULL;
+    if (with_coherence && PyObject_GetBuffer(coh_obj, &coh_buf, PyBUF_WRITABLE) < 0) {
+        PyBuffer_Release(&cos_buf);
+        PyBuffer_Release(&sin_buf);
+        PyBuffer_Release(&dec_buf);
+        PyBuffer_Release(&fid_buf);
+        return NULL;
+    }
+
+    PyObject *result = NULL;
+    Py_ssize_t n_points = cos_buf.len / (Py_ssize_t)sizeof(double);
+    Py_ssize_t n_decays = dec_buf.len / (Py_ssize_t)sizeof(double);
+    if (sin_buf.len != cos_buf.len || fid_buf.len != cos_buf.len
+        || (with_coherence && coh_buf.len != cos_buf.len)) {
+        PyErr_SetString(PyExc_ValueError, "qfa_scan: stream and output buffers must have the same length");
+        goto done;
+    }
+    if (n_decays < 1 || n_decays > QFA_MAX_DECAYS) {
+        PyErr_Format(PyExc_ValueError, "qfa_scan: supports 1-%d decays, got %zd", QFA_MAX_DECAYS, n_decays);
+        goto done;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    qfa_scan_avx2((const double *)cos_buf.buf, (const double *)sin_buf.buf, n_points,
+                  (const double *)dec_buf.buf, n_decays, bidirectional,
+                  (double *)fid_buf.buf, with_coherence ? (double *)coh_buf.buf : NULL);
+    Py_END_ALLOW_THREADS
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+done:
+    PyBuffer_Release(&cos_buf);
+    PyBuffer_Release(&sin_buf);
+    PyBuffer_Release(&dec_buf);
+    PyBuffer_Release(&fid_buf);
+    if (with_coherence)
+        PyBuffer_Release(&coh_buf);
+    return result;
+}
+
+static PyMethodDef qfa_kernel_methods[] = {
+    {"qfa_scan", qfa_scan, METH_VARARGS,
+     "qfa_scan(cos_theta, sin_theta, decays, fidelity_out, coherence_out, bidirectional)\n"
+     "float64 contiguous buffers, fills the outputs in place. coherence_out may be None."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef qfa_kernel_module = {
+    PyModuleDef_HEAD_INIT, "qfa_kernel", "AVX2 QFA kernel", -1, qfa_kernel_methods
+};
+
+PyMODINIT_FUNC PyInit_qfa_kernel(void)
+{
+    /* the kernel needs AVX2 + FMA, refuse to import otherwise so qfa_engine falls back to Numba */
+    __builtin_cpu_init();
+    if (!__builtin_cpu_supports("avx2") || !__builtin_cpu_supports("fma")) {
+        PyErr_SetString(PyExc_ImportError, "qfa_kernel: CPU lacks AVX2/FMA");
+        return NULL;
+    }
+    return PyModule_Create(&qfa_kernel_module);
+}
+
+#else /* not x86 */
+
+PyMODINIT_FUNC PyInit_qfa_kernel(void)
+{
+    PyErr_SetString(PyExc_ImportError, "qfa_kernel: AVX2 kernel is x86 only");
+    return NULL;
+}
+
+#endif
@@ -1,17 +1,22 @@
 import argparse
 import numpy as np
 import pandas as pd
+import pyarrow.csv as pac
 import logging
 import time
 import os
 import glob
+import hashlib
+import tempfile
+import queue
+import threading
 from pathlib import Path
-from scipy.stats import median_abs_deviation
 import concurrent.futures
+import numba
 
 from config import QFAConfig
-from preprocessing import calculate_adaptive_sensitivity
-from qfa_engine import MultiScaleQFA
+from preprocessing import calculate_adaptive_sensitivity, mad_normal, nan_median
+from qfa_engine import MultiScaleQFA, scan_batch
 
 # setup logging
 logging.basicConfig(
@@ -20,6 +25,11 @@ logging.basicConfig(
     datefmt='%H:%M:%S'
 )
 
+# seconds the batch consumer waits for more files before dispatching a partial window
+BATCH_TIMEOUT = 0.5
+# batches prepared and length-sorted together before scanning
+BATCH_WINDOW = 4
+
 def binning_downsample(t, f, target_pct=15.0):
     """
     Adaptive Binning: Bins data to reduce point count to target_pct%.
@@ -30,17 +40,66 @@ def binning_downsample(t, f, target_pct=15.0):
     bin_size = max(1, n // target_n)
     n_bins = n // bin_size
     
-    # reshape and mean
+    # per-bin sums straight from the input, divided into means
     # discards remainder points at end of array
-    t_trim = t[:n_bins*bin_size]
-    f_trim = f[:n_bins*bin_size]
+    n_used = n_bins * bin_size
+    edges = np.arange(0, n_used, bin_size)
     
-    t_bin = t_trim.reshape(n_bins, bin_size).mean(axis=1)
-    f_bin = f_trim.reshape(n_bins, bin_size).mean(axis=1)
+    t_bin = np.add.reduceat(t[:n_used], edges) / bin_size
+    f_bin = np.add.reduceat(f[:n_used], edges) / bin_size
     
     return t_bin, f_bin
 
-def process_file(file_path, output_dir, config):
+def _cache_path(file_path, cache_dir):
+    """
+    Cache file for a CSV lightcurve. The name carries a hash of the source's
+    absolute path, size and mtime, so two inputs with the same stem (or a
+    copy that kept an old mtime) never share an entry, and an edited CSV
+    gets a fresh one.
+    """
+    st = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{Path(file_path).stem}_{digest}.npy")
+
+def load_lightcurve(file_path, cache_dir=None):
+    """
+    Loads the time and flux columns of a CSV lightcurve.
+    Uses Arrow's multi-threaded CSV parser. When cache_dir is set, the
+    columns are saved once as .npy and memory-mapped on later runs.
+    Returns None if the 'time' or 'flux' column is missing.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = _cache_path(file_path, cache_dir)
+        if os.path.exists(cache_path):
+            data = np.load(cache_path, mmap_mode='r')
+            return data[0], data[1]
+
+    tbl = pac.read_csv(
+        file_path,
+        convert_options=pac.ConvertOptions(column_types={'time': 'float64', 'flux': 'float64'})
+    )
+    if 'time' not in tbl.column_names or 'flux' not in tbl.column_names:
+        return None
+
+    t = tbl['time'].to_numpy()
+    f = tbl['flux'].to_numpy()
+
+    if cache_path is not None:
+        # write to a temp file and rename, an interrupted run never leaves a truncated entry
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.save(fh, np.stack([t, f]))
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    return t, f
+
+def process_file(file_path, output_dir, config, cache_dir=None):
     """
     Runs QFA Augmented Binning Strategy on a single CSV file
     Strategy: Standard Binning (Baseline) + QFA Points (Detail).
@@ -49,30 +108,64 @@ def process_file(file_path, output_dir, config):
     
     try:
         # load data
-        df = pd.read_csv(file_path)
-        
-        if 'time' not in df.columns or 'flux' not in df.columns:
+        lightcurve = load_lightcurve(file_path, cache_dir)
+    except Exception as e:
+        logging.error(f"Failed to process {filename}: {e}")
+        return
+    
+    process_lightcurve(filename, lightcurve, output_dir, config)
+
+def process_lightcurve(filename, lightcurve, output_dir, config):
+    """
+    Runs QFA Augmented Binning Strategy on an already loaded lightcurve.
+    lightcurve is the (time, flux) pair from load_lightcurve, or None.
+    """
+    try:
+        if lightcurve is None:
             logging.warning(f"Skipping {filename}: Missing 'time' or 'flux'.")
             return
 
-        t = df['time'].values
-        f = df['flux'].values
-        
-        # NaNs
-        if np.isnan(f).any():
-            f = np.nan_to_num(f, nan=np.nanmedian(f))
-
-        # normalization
-        f_norm = f - np.median(f)
-        mad = median_abs_deviation(f_norm, scale='normal')
-        if mad < 1e-12: mad = 1e-12
-        f_norm = f_norm / mad
+        t, f, f_norm, adaptive_sens = prepare_lightcurve(lightcurve, config)
         
         # qfa scan (calculate fidelity)
-        adaptive_sens = calculate_adaptive_sensitivity(f_norm, config.sensitivity)
         engine = MultiScaleQFA(adaptive_sens, config.decays, config.gain_autoscaling)
         fidelity = engine.scan(f_norm, bidirectional=config.bidirectional_scan)
         
+    except Exception as e:
+        logging.error(f"Failed to process {filename}: {e}")
+        return
+    
+    write_augmented(filename, t, f, fidelity, output_dir, config)
+
+def prepare_lightcurve(lightcurve, config):
+    """
+    NaN imputation, normalization and adaptive sensitivity.
+    Returns (t, f, f_norm, adaptive_sens), f has its NaNs filled.
+    """
+    t, f = lightcurve
+    
+    # NaNs
+    # one pass for the NaN count and the median, reused for normalization
+    f_median, n_nan = nan_median(f)
+    if n_nan:
+        f = np.where(np.isnan(f), f_median, f)
+
+    # normalization
+    f_norm = f - f_median
+    mad = mad_normal(f_norm)
+    if mad < 1e-12: mad = 1e-12
+    f_norm = f_norm / mad
+    
+    adaptive_sens = calculate_adaptive_sensitivity(f_norm, config.sensitivity)
+    
+    return t, f, f_norm, adaptive_sens
+
+def write_augmented(filename, t, f, fidelity, output_dir, config):
+    """
+    Augmented binning from a scanned lightcurve, saves the result CSV.
+    Strategy: Standard Binning (Baseline) + QFA Points (Detail).
+    """
+    try:
         # strategy: augmented binning
         
         # binning (baseline)
@@ -83,22 +176,31 @@ def process_file(file_path, output_dir, config):
         # qfa selection (detail)
         # 5%
         n_select = int(len(f) * (config.qfa_pct / 100.0))
-        qfa_idx = np.argsort(fidelity)[:n_select]
+        # only the n_select lowest are needed, then put them in time order
+        kth = min(n_select, len(fidelity) - 1)
+        qfa_idx = np.argpartition(fidelity, kth)[:n_select]
+        qfa_idx = qfa_idx[np.argsort(t[qfa_idx])]
         
         t_qfa = t[qfa_idx]
         f_qfa = f[qfa_idx]
-        source_qfa = np.ones(len(t_qfa), dtype=int) # 1 = QFA
-        
-        # combine
-        t_final = np.concatenate([t_bin, t_qfa])
-        f_final = np.concatenate([f_bin, f_qfa])
-        source_final = np.concatenate([source_bin, source_qfa])
         
-        # sort (time order)
-        sort_mask = np.argsort(t_final)
-        t_final = t_final[sort_mask]
-        f_final = f_final[sort_mask]
-        source_final = source_final[sort_mask]
+        # combine (time order)
+        if np.all(t_bin[1:] >= t_bin[:-1]):
+            # bins are already sorted: merge the qfa points in, no global sort
+            insert_at = np.searchsorted(t_bin, t_qfa)
+            t_final = np.insert(t_bin, insert_at, t_qfa)
+            f_final = np.insert(f_bin, insert_at, f_qfa)
+            source_final = np.insert(source_bin, insert_at, 1) # 1 = QFA
+        else:
+            # unsorted input: fall back to sorting the concatenation
+            source_qfa = np.ones(len(t_qfa), dtype=int) # 1 = QFA
+            t_final = np.concatenate([t_bin, t_qfa])
+            f_final = np.concatenate([f_bin, f_qfa])
+            source_final = np.concatenate([source_bin, source_qfa])
+            sort_mask = np.argsort(t_final)
+            t_final = t_final[sort_mask]
+            f_final = f_final[sort_mask]
+            source_final = source_final[sort_mask]
         
         # save results
         output_df = pd.DataFrame({
@@ -115,6 +217,116 @@ def process_file(file_path, output_dir, config):
     except Exception as e:
         logging.error(f"Failed to process {filename}: {e}")
 
+def prepare_for_batch(filename, lightcurve, config):
+    """
+    Per-file half of batch mode: prepare_lightcurve plus the gate basis.
+    Runs in the thread pool so only the scan itself is batched.
+    Returns (filename, t, f, (cos_theta, sin_theta)), or None if skipped.
+    """
+    try:
+        if lightcurve is None:
+            logging.warning(f"Skipping {filename}: Missing 'time' or 'flux'.")
+            return None
+        t, f, f_norm, adaptive_sens = prepare_lightcurve(lightcurve, config)
+        engine = MultiScaleQFA(adaptive_sens, config.decays, config.gain_autoscaling)
+        return filename, t, f, engine.gate_basis(f_norm)
+    except Exception as e:
+        logging.error(f"Failed to process {filename}: {e}")
+        return None
+
+def process_batch(batch, config):
+    """
+    Scans a list of prepared lightcurves (from prepare_for_batch) with one
+    batched kernel call. Returns (filename, t, f, fidelity) for every
+    lightcurve, ready for write_augmented.
+    """
+    try:
+        fidelities = scan_batch([p[3] for p in batch], config.decays, config.bidirectional_scan)
+    except Exception as e:
+        for p in batch:
+            logging.error(f"Failed to process {p[0]}: {e}")
+        return []
+    
+    return [(p[0], p[1], p[2], fidelity) for p, fidelity in zip(batch, fidelities)]
+
+def _warmup(config, batch_size=1):
+    """
+    Runs the jitted kernels once on a tiny stream so they are loaded
+    (or compiled) before the worker threads pick up their first real file.
+    The kernels use cache=True, so after the first run this only loads the
+    machine code from __pycache__. Numba already targets the host CPU
+    (AVX2/AVX-512 where available), NUMBA_CPU_NAME should stay unset.
+    """
+    mad_normal(np.zeros(8))
+    nan_median(np.zeros(8))
+    engine = MultiScaleQFA(config.sensitivity, config.decays, config.gain_autoscaling)
+    if batch_size > 1:
+        scan_batch([engine.gate_basis(np.zeros(8))], config.decays, config.bidirectional_scan)
+        return
+    engine.scan(np.zeros(8), bidirectional=config.bidirectional_scan)
+
+def _load_files(files, cache_dir, lightcurve_queue, n_workers):
+    """
+    Producer: reads lightcurves ahead of the workers so file I/O overlaps
+    with QFA compute. The bounded queue stops it from running too far ahead.
+    Posts one None sentinel per worker when done.
+    """
+    for file_path in files:
+        filename = os.path.basename(file_path)
+        try:
+            lightcurve = load_lightcurve(file_path, cache_dir)
+        except Exception as e:
+            logging.error(f"Failed to process {filename}: {e}")
+            continue
+        lightcurve_queue.put((filename, lightcurve))
+    for _ in range(n_workers):
+        lightcurve_queue.put(None)
+
+def _process_queue(lightcurve_queue, output_dir, config):
+    """
+    Consumer: processes loaded lightcurves until the sentinel arrives.
+    """
+    while True:
+        item = lightcurve_queue.get()
+        if item is None:
+            return
+        filename, lightcurve = item
+        process_lightcurve(filename, lightcurve, output_dir, config)
+
+def _process_queue_batched(lightcurve_queue, executor, output_dir, config, batch_size):
+    """
+    Single consumer for batch mode. Loaded lightcurves are prepared in the
+    thread pool as they arrive, until BATCH_WINDOW batches are pending (or
+    the loader stalls for BATCH_TIMEOUT). The window is then sorted by length
+    and split into batches of similar length, each scanned in one parallel
+    kernel call, and the writes go back to the pool.
+    Returns the write futures.
+    """
+    futures = []
+    done = False
+    while not done:
+        item = lightcurve_queue.get()
+        if item is None:
+            break
+        pending = [executor.submit(prepare_for_batch, *item, config)]
+        while len(pending) < batch_size * BATCH_WINDOW:
+            try:
+                item = lightcurve_queue.get(timeout=BATCH_TIMEOUT)
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+                break
+            pending.append(executor.submit(prepare_for_batch, *item, config))
+        
+        # similar lengths per batch keep the padded (B, N_max) buffers small
+        prepared = [p for p in (future.result() for future in pending) if p is not None]
+        prepared.sort(key=lambda p: len(p[1]))
+        for start in range(0, len(prepared), batch_size):
+            for filename, t, f, fidelity in process_batch(prepared[start:start + batch_size], config):
+                futures.append(executor.submit(write_augmented, filename, t, f, fidelity, output_dir, config))
+    return futures
+
 # main
 def main():
     # arguments
@@ -122,15 +334,23 @@ def main():
     parser.add_argument('--input_dir', type=str, required=True, help='Directory containing flattened .csv files')
     parser.add_argument('--output_dir', type=str, default='./qfa_augmented_results', help='Directory to save results')
     parser.add_argument('--qfa_pct', type=float, default=5.0, help='Percentage of QFA points to keep (Default: 5.0)')
-    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of parallel worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of parallel worker threads')
+    parser.add_argument('--cache-npy', action='store_true', help='Cache parsed lightcurves as .npy in the output directory for faster reruns')
+    parser.add_argument('--batch_size', type=int, default=1, help='Files per batched parallel kernel call (Default: 1, per-file scans)')
     
     # parse arguments
     args = parser.parse_args()
     config = QFAConfig()
     config.qfa_pct = args.qfa_pct # inject runtime override
+    config.decays = np.asarray(config.decays, dtype=np.float64) # convert once, shared by every engine
     
     Path(args.output_dir).mkdir(parents=True, exist_ok=True)
     
+    cache_dir = None
+    if args.cache_npy:
+        cache_dir = os.path.join(args.output_dir, "npy_cache")
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    
     files = glob.glob(os.path.join(args.input_dir, "*.csv"))
     if not files:
         logging.error(f"No .csv files found in {args.input_dir}")
@@ -140,13 +360,38 @@ def main():
     
     start_time = time.time()
     
-    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
-        futures = [executor.submit(process_file, f, args.output_dir, config) for f in files]
+    # the kernels are nopython + nogil, so threads share one jit cache
+    # and run concurrently without process spawn or pickling
+    batched = args.batch_size > 1
+    if batched:
+        # the batch kernel parallelizes over files itself
+        numba.set_num_threads(max(1, min(args.workers, numba.config.NUMBA_NUM_THREADS)))
+    _warmup(config, args.batch_size)
+    
+    # one loader thread feeds the workers (producer-consumer)
+    n_consumers = 1 if batched else args.workers
+    lightcurve_queue = queue.Queue(maxsize=max(args.workers, args.batch_size) * 2)
+    loader = threading.Thread(
+        target=_load_files, args=(files, cache_dir, lightcurve_queue, n_consumers), daemon=True
+    )
+    loader.start()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        if batched:
+            # one consumer in this thread batches the scans, the pool prepares and writes
+            futures = _process_queue_batched(
+                lightcurve_queue, executor, args.output_dir, config, args.batch_size
+            )
+        else:
+            futures = [
+                executor.submit(_process_queue, lightcurve_queue, args.output_dir, config)
+                for _ in range(args.workers)
+            ]
         for future in concurrent.futures.as_completed(futures):
             try:
                 future.result()
             except Exception as e:
                 logging.error(f"Worker Error: {e}")
+    loader.join()
                 
     total_time = time.time() - start_time
     logging.info(f"Complete. Processed {len(files)} files in {total_time:.2f}s.")
@@ -0,0 +1,17 @@
+from setuptools import setup, Extension
+
+# optional AVX2 kernel for the QFA engine, build in place with:
+#   python setup.py build_ext --inplace
+# qfa_engine falls back to the Numba kernels when it is not built,
+# a failed build (e.g. no C compiler) only warns
+setup(
+    name='qfa_kernel',
+    ext_modules=[
+        Extension(
+            'qfa_kernel',
+            sources=['qfa_kernel.c'],
+            extra_compile_args=['-O3', '-ffast-math'],
+            optional=True,
+        )
+    ],
+)